@@ -1,6 +1,5 @@
 import argparse
 from contextlib import ExitStack
-import json
 import logging
 import re
 import signal
@@ -318,8 +317,6 @@ equivalent to `--format mime`"""))
                                 log.info(f"Found {args.max_matches} matches; stopping early")
                                 break
         if needs_sbud:
-            sbud = analyzer.sbud(matches=analyzer.matches_so_far)
-
             if args.require_match and not analyzer.matches_so_far:
                 log.info("No matches found, exiting")
                 exit(127)
@@ -374,12 +371,12 @@ equivalent to `--format mime`"""))
                         log.info(f"Saved MIME output to {output_format.output_path}")
                 elif output_format.output_format == "json" or output_format.output_format == "sbud":
                     assert needs_sbud
-                    json.dump(sbud, output)
+                    analyzer.write_sbud(output, matches=analyzer.matches_so_far)
                     if not output_format.output_to_stdout:
                         log.info(f"Saved {output_format.output_format.upper()} output to {output_format.output_path}")
                 elif output_format.output_format == "html":
                     assert needs_sbud
-                    output.write(html.generate(file_path, sbud))
+                    output.write(html.generate(file_path, analyzer.sbud(matches=analyzer.matches_so_far)))
                     if not output_format.output_to_stdout:
                         log.info(f"Saved HTML output to {output_format.output_path}")
                 else:
@@ -54,16 +54,16 @@ class Node:
         while stack:
             node, parent = stack.pop()
             if parent is None:
-                parent_offset = 0
+                match = Submatch(
+                    name=node.name,
+                    match_obj=node.value,
+                    relative_offset=node.offset,
+                    length=node.length,
+                    parent=parent
+                )
             else:
-                parent_offset = parent.offset
-            match = Submatch(
-                name=node.name,
-                match_obj=node.value,
-                relative_offset=node.offset - parent_offset,
-                length=node.length,
-                parent=parent
-            )
+                # the ASTs of large files can have a great many nodes, so skip the argument validation
+                match = Submatch._fast(node.name, node.value, node.offset - parent.offset, node.length, parent)
             yield match
             for child in reversed(node.children):
                 stack.append((child, match))
@@ -8,7 +8,12 @@ import sys
 from typing import AnyStr, ContextManager, IO, Iterator, Iterable, List, Optional, TextIO, Union
 
 
-Streamable = Union[str, Path, IO, "FileStream", bytes]
+Streamable = Union[str, Path, IO, "FileStream", bytes, mmap.mmap]
+
+# files smaller than this many bytes are read into memory rather than being memory mapped by `mmap_stream`
+MMAP_THRESHOLD: int = 1024 * 1024
+# the number of bytes at each end of a memory mapped file that `mmap_stream` asks the kernel to read ahead
+READAHEAD_WINDOW: int = 1024 * 1024
 
 
 def make_stream(path_or_stream: Streamable, mode: str = 'rb',
@@ -19,6 +24,92 @@ def make_stream(path_or_stream: Streamable, mode: str = 'rb',
         return FileStream(path_or_stream, mode=mode, close_on_exit=close_on_exit)
 
 
+def _mappable_fileno(stream: IO, min_size: int) -> Optional[int]:
+    """Returns the descriptor of the file underlying `stream` if all of it can be memory mapped, or None otherwise"""
+    try:
+        fileno = stream.fileno()
+        size = os.fstat(fileno).st_size
+    except (AttributeError, OSError, ValueError):
+        return None
+    if size < max(min_size, 1) or not _spans_file(stream, size):
+        return None
+    return fileno
+
+
+def _spans_file(stream: IO, size: int) -> bool:
+    """Returns whether `stream` is positioned at the start of its underlying file of `size` bytes and spans all of it"""
+    if isinstance(stream, FileStream):
+        return stream.offset() == 0 and len(stream) == size and stream.tell() == 0
+    return stream.tell() == 0
+
+
+def _advise_readahead(fileno: int):
+    """Advises the kernel to read ahead the first and last `READAHEAD_WINDOW` bytes of a file, if supported"""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    size = os.fstat(fileno).st_size
+    for start in {0, max(size - READAHEAD_WINDOW, 0)}:
+        try:
+            os.posix_fadvise(fileno, start, READAHEAD_WINDOW, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+
+def _advise_sequential(mapped: mmap.mmap):
+    """Advises the kernel that a memory map will be read sequentially, if supported"""
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        try:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        except OSError:
+            pass
+
+
+def mmap_stream(stream: IO, min_size: Optional[int] = None) -> Optional[mmap.mmap]:
+    """
+    Returns a read-only memory map of the entire file underlying `stream`.
+
+    Returns None if the stream is not backed by a file, is smaller than `min_size` bytes (by default
+    `MMAP_THRESHOLD`), or is not positioned at the start of the file (or, for a `FileStream`, does not span the
+    entire file).
+
+    Where the platform supports it, the kernel is advised to read ahead the first and last `READAHEAD_WINDOW` bytes,
+    which is where most magic tests look; the rest of the file is only paged in if a test actually reads it.
+
+    The caller owns the returned map and must close it; `MemoryMap` does so automatically.
+
+    """
+    if min_size is None:
+        min_size = MMAP_THRESHOLD
+    fileno = _mappable_fileno(stream, min_size)
+    if fileno is None:
+        return None
+    _advise_readahead(fileno)
+    try:
+        mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    _advise_sequential(mapped)
+    return mapped
+
+
+class MemoryMap:
+    """A context manager returning `mmap_stream(stream, min_size)` that closes the memory map, if any, on exit"""
+
+    def __init__(self, stream: IO, min_size: Optional[int] = None):
+        self.stream: IO = stream
+        self.min_size: Optional[int] = min_size
+        self._mapped: Optional[mmap.mmap] = None
+
+    def __enter__(self) -> Optional[mmap.mmap]:
+        self._mapped = mmap_stream(self.stream, self.min_size)
+        return self._mapped
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+
 class Tempfile:
     def __init__(self, contents: bytes, prefix: Optional[str] = None, suffix: Optional[str] = None):
         self._path: Optional[str] = None
@@ -120,6 +211,9 @@ class FileStream(IO):
             if isinstance(path_or_stream, bytes):
                 path_or_stream = BytesIO(path_or_stream)
                 setattr(path_or_stream, "name", "bytes")
+            elif isinstance(path_or_stream, mmap.mmap):
+                # memory maps can be read and seeked like a file, but have neither `seekable` nor `readable`
+                pass
             elif not path_or_stream.seekable():
                 raise ValueError('FileStream can only wrap streams that are seekable')
             elif not path_or_stream.readable():
@@ -138,6 +232,8 @@ class FileStream(IO):
                     filesize = path_or_stream.tell()
                 finally:
                     path_or_stream.seek(orig_pos)
+            elif isinstance(path_or_stream, mmap.mmap):
+                filesize = len(path_or_stream)
             else:
                 filesize = os.path.getsize(self._stream.name)
             if length is None:
@@ -146,7 +242,10 @@ class FileStream(IO):
                 self._length = min(filesize, length) - start
         if close_on_exit is None:
             close_on_exit = False
-        self._name = self._stream.name
+        if isinstance(self._stream, mmap.mmap):
+            self._name = "mmap"
+        else:
+            self._name = self._stream.name
         self.start = start
         self.close_on_exit = close_on_exit
         self._entries = 0
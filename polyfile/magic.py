@@ -16,13 +16,16 @@ from enum import Enum, IntFlag
 from io import StringIO
 import json
 import logging
+from mmap import mmap
 from pathlib import Path
 import re
 import struct
 import sys
+from threading import RLock
 from time import gmtime, localtime, strftime
 from typing import (
-    Any, BinaryIO, Callable, Dict, Generic, Iterable, Iterator, List, Optional, Set, Tuple, Type, TypeVar, Union
+    Any, BinaryIO, Callable, Dict, FrozenSet, Generic, Iterable, Iterator, List, Optional, Set, Tuple, Type, TypeVar,
+    Union
 )
 from uuid import UUID
 
@@ -33,6 +36,7 @@ from .fileutils import Streamable
 from .iterators import LazyIterableSet
 from .logger import getStatusLogger, TRACE
 from .repl import ANSIColor, ANSIWriter
+from .search import StartsWithMatcher
 
 
 if sys.version_info < (3, 9):
@@ -539,16 +543,33 @@ class SourceInfo:
 
 
 class MatchContext:
-    def __init__(self, data: bytes, path: Optional[Path] = None, only_match_mime: bool = False):
-        self.data: bytes = data
+    def __init__(self, data: Union[bytes, mmap], path: Optional[Path] = None, only_match_mime: bool = False):
+        self.data: Union[bytes, mmap] = data
         self.path: Optional[Path] = path
         self.only_match_mime: bool = only_match_mime
+        self._indirect_results: Dict[Tuple["MagicMatcher", int], List[TestResult]] = {}
 
     def __getitem__(self, s: slice) -> "MatchContext":
         if not isinstance(s, slice):
             raise ValueError("Match contexts can only be sliced")
         return MatchContext(data=self.data[s], path=self.path, only_match_mime=self.only_match_mime)
 
+    def indirect_results(self, matcher: "MagicMatcher", offset: int) -> List[TestResult]:
+        """
+        Returns the results of all of the matches of `matcher` against the data starting at `offset`
+
+        The results are memoized, so every indirect test that resolves to the same offset within this context shares a
+        single evaluation of the matcher. Only the results are kept, not the matches or the sliced context they were
+        matched against, so the memo does not hold a copy of the rest of the data.
+
+        """
+        key = (matcher, offset)
+        results = self._indirect_results.get(key)
+        if results is None:
+            results = [result for match in matcher.match(self[offset:]) for result in match]
+            self._indirect_results[key] = results
+        return results
+
     @property
     def is_executable(self) -> bool:
         if self.path is None:
@@ -561,15 +582,29 @@ class MatchContext:
             return False
 
     @staticmethod
-    def load(stream_or_path: Union[str, Path, BinaryIO], only_match_mime: bool = False) -> "MatchContext":
+    def load(
+            stream_or_path: Union[str, Path, BinaryIO],
+            only_match_mime: bool = False,
+            data: Optional[Union[bytes, mmap]] = None
+    ) -> "MatchContext":
+        """
+        Loads the context of a file or stream
+
+        If `data` is not None, it is used as the file's contents rather than reading them from the stream. This lets
+        callers pass a memory map of the file (see `fileutils.MemoryMap`), which they own and must keep open for as
+        long as the context, or any match or result obtained from it, is used.
+
+        """
         if isinstance(stream_or_path, str) or isinstance(stream_or_path, Path):
             with open(stream_or_path, "rb") as f:
-                return MatchContext.load(f, only_match_mime)
+                return MatchContext.load(f, only_match_mime, data)
         if hasattr(stream_or_path, "name") and stream_or_path.name is not None:
             path: Optional[Path] = Path(stream_or_path.name)
         else:
             path = None
-        return MatchContext(stream_or_path.read(), path, only_match_mime)
+        if data is None:
+            data = stream_or_path.read()
+        return MatchContext(data, path, only_match_mime)
 
 
 class Message(ABC):
@@ -859,6 +894,14 @@ class MagicTest(ABC):
         """Returns the set of all possible extensions that this test or any of its descendants could match against"""
         return LazyIterableSet(self._all_extensions())
 
+    def literal_prefix(self) -> Optional[Tuple[int, bytes]]:
+        """
+        Returns an `(absolute_offset, literal)` pair such that this test can only match if the data contains `literal`
+        at `absolute_offset`, or None if this test is not anchored to such a literal.
+
+        """
+        return None
+
     @abstractmethod
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         raise NotImplementedError()
@@ -1042,6 +1085,15 @@ class DataType(ABC, Generic[T]):
     def match(self, data: bytes, expected: T) -> DataTypeMatch:
         raise NotImplementedError()
 
+    def literal_prefix(self, expected: T) -> Optional[bytes]:
+        """
+        Returns the exact bytes that data must start with in order to match `expected`.
+
+        Returns None if there is no such literal, in which case `self.match` must always be called.
+
+        """
+        return None
+
     @staticmethod
     def parse(fmt: str) -> "DataType":
         if fmt in TYPES_BY_NAME:
@@ -1130,6 +1182,9 @@ class UTF16Type(DataType[bytes]):
         else:
             return specification.encode("utf-16-be")
 
+    def literal_prefix(self, expected: bytes) -> Optional[bytes]:
+        return expected
+
     def match(self, data: bytes, expected: bytes) -> DataTypeMatch:
         if data.startswith(expected):
             if self.endianness == Endianness.LITTLE:
@@ -1330,6 +1385,7 @@ class StringMatch(StringTest):
         self._is_always_text: Optional[bool] = None
         self._pattern: Optional[re.Pattern] = None
         _ = self.pattern
+        self._literal: Optional[bytes] = self.string if self.is_literal else None
 
     def pattern_string(self) -> bytes:
         pattern = re.escape(self.string)
@@ -1377,6 +1433,12 @@ class StringMatch(StringTest):
             pattern = rb"\b" + pattern + rb"\b"
         return pattern
 
+    @property
+    def is_literal(self) -> bool:
+        """Whether this test matches exactly `self.string` and nothing else"""
+        return not any((self.case_insensitive_lower, self.case_insensitive_upper, self.compact_whitespace,
+                        self.optional_blanks, self.full_word_match))
+
     def pattern_flags(self) -> int:
         flags: int = 0
         if self.case_insensitive_upper and self.case_insensitive_lower:
@@ -1403,6 +1465,11 @@ class StringMatch(StringTest):
         return self._is_always_text
 
     def matches(self, data: bytes) -> DataTypeMatch:
+        if self._literal is not None:
+            # a plain byte comparison is much cheaper than running the regex
+            if data.startswith(self._literal):
+                return self.post_process(self._literal)
+            return DataTypeMatch.INVALID
         m = self.pattern.match(data)
         if m:
             return self.post_process(bytes(m.group(0)))
@@ -1468,6 +1535,11 @@ class StringType(DataType[StringTest]):
             num_bytes=self.num_bytes
         )
 
+    def literal_prefix(self, expected: StringTest) -> Optional[bytes]:
+        if isinstance(expected, StringMatch) and expected.is_literal:
+            return expected.string
+        return None
+
     def match(self, data: bytes, expected: StringTest) -> DataTypeMatch:
         return expected.matches(data)
 
@@ -1540,6 +1612,10 @@ class SearchType(StringType):
     def is_text(self, value: StringTest) -> bool:
         return value.is_always_text()
 
+    def literal_prefix(self, expected: StringTest) -> Optional[bytes]:
+        # searches can match anywhere within their range, so they are never anchored to a literal prefix
+        return None
+
     def match(self, data: bytes, expected: StringTest) -> DataTypeMatch:
         return expected.search(data)
 
@@ -2089,6 +2165,7 @@ class ConstantMatchTest(MagicTest, Generic[T]):
         super().__init__(offset=offset, mime=mime, extensions=extensions, message=message, parent=parent)
         self.data_type: DataType[T] = data_type
         self.constant: T = constant
+        self._literal: Optional[bytes] = data_type.literal_prefix(constant)
 
     def subtest_type(self) -> TestType:
         if self.data_type.is_text(self.constant):
@@ -2099,8 +2176,21 @@ class ConstantMatchTest(MagicTest, Generic[T]):
     def calculate_absolute_offset(self, data: bytes, parent_match: Optional[TestResult] = None) -> int:
         return self.offset.to_absolute(data, parent_match, self.data_type.allows_invalid_offsets(self.constant))
 
+    def literal_prefix(self) -> Optional[Tuple[int, bytes]]:
+        if type(self.offset) is not AbsoluteOffset:
+            return None
+        literal = self.data_type.literal_prefix(self.constant)
+        if not literal:
+            return None
+        return self.offset.offset, literal
+
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
-        match = self.data_type.match(data[absolute_offset:], self.constant)
+        literal = self._literal
+        if literal and absolute_offset >= 0 and data[absolute_offset:absolute_offset + len(literal)] != literal:
+            # fail without copying the remainder of the data
+            match = DataTypeMatch.INVALID
+        else:
+            match = self.data_type.match(data[absolute_offset:], self.constant)
         if match:
             return MatchedTest(self, offset=absolute_offset + match.initial_offset, length=len(match.raw_match),
                                value=match.value, parent=parent_match)
@@ -2527,8 +2617,7 @@ class Match:
                 result = next(self._result_iter)
                 self._results.append(result)
                 if isinstance(result, IndirectResult):
-                    for match in self.matcher.match(self.context[result.offset:]):
-                        self._results.extend(match)
+                    self._results.extend(self.context.indirect_results(self.matcher, result.offset))
             except StopIteration:
                 self._result_iter = None
         return self._results[index]
@@ -2572,19 +2661,27 @@ class Match:
 
 class DefaultMagicMatcher:
     _DEFAULT_INSTANCE: Optional["MagicMatcher"] = None
+    _LOCK: RLock = RLock()
 
     def __get__(self, instance, owner) -> "MagicMatcher":
         if DefaultMagicMatcher._DEFAULT_INSTANCE is None:
-            # DefaultMagicMatcher._DEFAULT_INSTANCE = MagicMatcher.parse(*MAGIC_DEFS)
-            # FIXME: skip the DER definition for now because we don't yet support it
-            DefaultMagicMatcher._DEFAULT_INSTANCE = MagicMatcher.parse(*(d for d in MAGIC_DEFS if d.name != "der"))
+            with DefaultMagicMatcher._LOCK:
+                # check again in case another thread parsed the definitions while we were waiting on the lock
+                if DefaultMagicMatcher._DEFAULT_INSTANCE is None:
+                    # DefaultMagicMatcher._DEFAULT_INSTANCE = MagicMatcher.parse(*MAGIC_DEFS)
+                    # FIXME: skip the DER definition for now because we don't yet support it
+                    DefaultMagicMatcher._DEFAULT_INSTANCE = MagicMatcher.parse(
+                        *(d for d in MAGIC_DEFS if d.name != "der")
+                    )
         return DefaultMagicMatcher._DEFAULT_INSTANCE
 
     def __set__(self, instance, value: Optional["MagicMatcher"]):
-        DefaultMagicMatcher._DEFAULT_INSTANCE = value
+        with DefaultMagicMatcher._LOCK:
+            DefaultMagicMatcher._DEFAULT_INSTANCE = value
 
     def __delete__(self, instance):
-        DefaultMagicMatcher._DEFAULT_INSTANCE = None
+        with DefaultMagicMatcher._LOCK:
+            DefaultMagicMatcher._DEFAULT_INSTANCE = None
 
 
 class MagicMatcher:
@@ -2598,6 +2695,12 @@ class MagicMatcher:
         self._tests_that_can_be_indirect: Set[MagicTest] = set()
         self._non_text_tests: Set[MagicTest] = set()
         self._text_tests: Set[MagicTest] = set()
+        self._anchored_tests: Set[MagicTest] = set()
+        self._anchors: Dict[int, StartsWithMatcher] = {}
+        self._anchor_lengths: Dict[int, int] = {}
+        self._only_match_cache: Dict[
+            Tuple[Optional[FrozenSet[str]], Optional[FrozenSet[str]]], MagicMatcher
+        ] = {}
         self._dirty: bool = True
         for test in tests:
             self.add(test)
@@ -2627,6 +2730,23 @@ class MagicMatcher:
         self._reassign_test_types()
         return self._text_tests
 
+    @property
+    def anchored_tests(self) -> Set[MagicTest]:
+        """The set of tests that are anchored to a literal prefix (see `MagicTest.literal_prefix`)"""
+        self._reassign_test_types()
+        return self._anchored_tests
+
+    def anchored_candidates(self, data: bytes) -> Set[MagicTest]:
+        """Returns the set of anchored tests whose literal prefix occurs at the expected offset in `data`"""
+        self._reassign_test_types()
+        candidates: Set[MagicTest] = set()
+        for offset, matcher in self._anchors.items():
+            if offset < len(data):
+                candidates.update(test for _, test in matcher.search(
+                    data[offset:offset + self._anchor_lengths[offset]]
+                ))
+        return candidates
+
     def add(self, test: Union[MagicTest, Path], test_type: TestType = TestType.UNKNOWN) -> List[MagicTest]:
         if not isinstance(test, MagicTest):
             level_zero_tests, _, tests_with_mime, indirect_tests = self._parse_file(test, self)
@@ -2647,6 +2767,7 @@ class MagicMatcher:
             test.test_type = test_type
 
         self._dirty = True
+        self._only_match_cache = {}
 
         if isinstance(test, NamedTest):
             if test.name in self.named_tests:
@@ -2666,7 +2787,19 @@ class MagicMatcher:
         self._tests_that_can_be_indirect = set()
         self._tests_by_ext = defaultdict(set)
         self._tests_by_mime = defaultdict(set)
+        self._anchored_tests = set()
+        self._anchors = {}
+        self._anchor_lengths = {}
         for test in self._tests:
+            anchor = test.literal_prefix()
+            if anchor is not None:
+                offset, literal = anchor
+                if offset not in self._anchors:
+                    self._anchors[offset] = StartsWithMatcher()
+                    self._anchor_lengths[offset] = 0
+                self._anchors[offset].trie.add(literal, test)
+                self._anchored_tests.add(test)
+                self._anchor_lengths[offset] = max(self._anchor_lengths[offset], len(literal))
             if test.test_type == TestType.TEXT:
                 self._text_tests.add(test)
             else:
@@ -2689,9 +2822,26 @@ class MagicMatcher:
         If either argument is None, the resulting matcher will match against all such values. Therefore, if both
         arguments are None, the resulting matcher will be equivalent to this matcher.
 
+        The resulting matcher is cached, so subsequent calls with the same arguments will return the same object until
+        a new test is added to this matcher.
+
         """
         if mimetypes is None and extensions is None:
             return self
+        if mimetypes is not None:
+            mimetypes = frozenset(mimetypes)
+        if extensions is not None:
+            extensions = frozenset(extensions)
+        cache_key = (mimetypes, extensions)
+        if cache_key not in self._only_match_cache:
+            self._only_match_cache[cache_key] = self._only_match(mimetypes, extensions)
+        return self._only_match_cache[cache_key]
+
+    def _only_match(
+            self,
+            mimetypes: Optional[FrozenSet[str]],
+            extensions: Optional[FrozenSet[str]]
+    ) -> "MagicMatcher":
         tests: Set[MagicTest] = {
             indirect_test for indirect_test in self.tests_that_can_be_indirect
             if not any(True for _ in indirect_test.mimetypes())
@@ -2727,7 +2877,13 @@ class MagicMatcher:
         elif not isinstance(to_match, MatchContext):
             to_match = MatchContext.load(to_match)
         yielded = False
+        # tests anchored to a literal prefix can only match if that literal is present, so rather than running each
+        # test separately, find all of the literals that are present in a single pass:
+        anchored_tests = self.anchored_tests
+        candidates = self.anchored_candidates(to_match.data)
         for test in log.range(self.non_text_tests, desc="binary matching", unit=" tests", delay=1.0):
+            if test in anchored_tests and test not in candidates:
+                continue
             m = Match(matcher=self, context=to_match, results=test.match(to_match))
             if m and (not to_match.only_match_mime or any(t is not None for t in m.mimetypes)):
                 yield m
@@ -2738,6 +2894,8 @@ class MagicMatcher:
         if is_text:
             # this is a text file, so try all of the textual tests:
             for test in log.range(self.text_tests, desc="text matching", unit=" tests", delay=1.0):
+                if test in anchored_tests and test not in candidates:
+                    continue
                 m = Match(matcher=self, context=to_match, results=test.match(to_match))
                 if m and (not to_match.only_match_mime or any(t is not None for t in m.mimetypes)):
                     yield m
@@ -1004,7 +1004,7 @@ class RelaxedPDFMatcher(MagicTest):
         return TestType.BINARY
 
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
-        if b"%PDF-" in data:
+        if data.find(b"%PDF-") >= 0:
             return MatchedTest(self, value=data, offset=0, length=len(data))
         return FailedTest(self, offset=0, message="data did not contain \"%PDF-\"")
 
@@ -20,12 +20,11 @@ class PickleMatcher(DynamicMagicTest):
 
     def test(self, data: bytes, absolute_offset: int, parent_match: Optional[TestResult]) -> TestResult:
         prev = -1
-        for i, c in enumerate(data):
-            if i >= 128:
-                break
-            elif prev == 0x80 and c in (2, 3, 4):
+        # slice so that we iterate over ints even if `data` is memory mapped
+        for c in data[:128]:
+            if prev == 0x80 and c in (2, 3, 4):
                 try:
-                    pickled = Pickled.load(data)
+                    pickled = Pickled.load(bytes(data))
                     results = Analyzer.default_instance.analyze(pickled)
                     if results.severity <= Severity.LIKELY_SAFE:
                         message = self.message
@@ -1,16 +1,17 @@
 from abc import ABC, abstractmethod
+from binascii import b2a_base64
 from collections import defaultdict
-import base64
+from functools import lru_cache
 import hashlib
-from json import dumps
+from json import dump, dumps
 from mimetypes import guess_extension
 from pathlib import Path
 import sys
 from time import localtime
 import traceback
-from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from typing import Any, Callable, Dict, FrozenSet, IO, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
-from .fileutils import FileStream
+from .fileutils import FileStream, MemoryMap
 from . import logger
 from .magic import MagicMatcher, Match as MagicMatch, MatchContext, TestResult
 
@@ -65,14 +66,60 @@ class ParserFunctionWrapper(Parser):
 
 PARSERS: Dict[str, Set[Parser]] = defaultdict(set)
 
+_REGISTRATION_ORDER: Dict[Parser, int] = {}
+# the snapshot of each MIME type's parsers, along with the members of `PARSERS[mimetype]` it was taken from
+_FROZEN_PARSERS: Dict[str, Tuple[FrozenSet[Parser], Tuple[Parser, ...]]] = {}
+
+
+def _freeze_parsers(parsers: Set[Parser]) -> Tuple[FrozenSet[Parser], Tuple[Parser, ...]]:
+    unregistered = len(_REGISTRATION_ORDER)
+    # parsers that were added to PARSERS directly rather than with `register_parser` come last, ordered by name
+    return frozenset(parsers), tuple(sorted(parsers, key=lambda p: (_REGISTRATION_ORDER.get(p, unregistered), str(p))))
+
+
+def frozen_parsers(mimetype: str) -> Tuple[Parser, ...]:
+    """
+    Returns an immutable snapshot of the parsers in `PARSERS[mimetype]`, in registration order
+
+    `register_parser` builds the snapshot; it is only rebuilt here if the members of `PARSERS[mimetype]` were changed
+    directly.
+
+    """
+    parsers = PARSERS.get(mimetype)
+    if not parsers:
+        return ()
+    cached = _FROZEN_PARSERS.get(mimetype)
+    if cached is None or cached[0] != parsers:
+        cached = _FROZEN_PARSERS[mimetype] = _freeze_parsers(parsers)
+    return cached[1]
+
+
 log = logger.getStatusLogger("polyfile")
 
+# the number of bytes read at a time when hashing and encoding a file; a multiple of three so base64 chunks join
+SBUD_CHUNK_SIZE: int = 3 * 1024 * 1024
+
 
 class InvalidMatch(ValueError):
     pass
 
 
+@lru_cache(maxsize=1024)
+def _guess_extension(name: str) -> Optional[str]:
+    """A cached `guess_extension` with any leading dot removed; bounded since names can come from file content"""
+    extension = guess_extension(name)
+    if extension is not None and extension.startswith("."):
+        # guess_extension adds a leading dot
+        extension = extension[1:]
+    return extension
+
+
 class Match:
+    __slots__ = (
+        "_children", "name", "matcher", "match", "img_data", "decoded", "_offset", "_length", "_parent",
+        "_max_child_end", "_global_offset", "_root", "display_name", "extension"
+    )
+
     def __init__(
             self,
             name: str,
@@ -95,12 +142,18 @@ class Match:
         self._offset: int = relative_offset
         self._length: Optional[int] = length
         self._parent: Optional[Match] = parent
+        self._max_child_end: Optional[int] = None
         if parent is not None:
             if not isinstance(parent, Match):
                 raise ValueError("The parent must be an instance of a Match")
-            parent._children.append(self)
+            self._global_offset: int = parent._global_offset + relative_offset
+            self._root: Match = parent._root
+            parent._add_child(self)
             if matcher is None:
                 matcher = parent.matcher
+        else:
+            self._global_offset = relative_offset
+            self._root = self
         if matcher is None:
             raise(ValueError("A Match must be initialized with `parent` and/or `matcher` not being None"))
         self.matcher = matcher
@@ -108,12 +161,42 @@ class Match:
             self.display_name: str = name
         else:
             self.display_name = display_name
-        self.extension: Optional[str] = extension
         if extension is None:
-            self.extension = guess_extension(self.name)
-            if self.extension is not None and self.extension.startswith("."):
-                # guess_extension adds a leading dot
-                self.extension = self.extension[1:]
+            extension = _guess_extension(name)
+        self.extension: Optional[str] = extension
+
+    @classmethod
+    def _fast(cls, name: str, match_obj: Any, relative_offset: int, length: Optional[int], parent: "Match"):
+        """
+        Equivalent to `cls(name, match_obj, relative_offset, length, parent)`, but without validating the arguments
+
+        This is for trusted code that creates very many matches under an existing `parent`.
+
+        """
+        match = cls.__new__(cls)
+        match._children = []
+        match.name = match.display_name = name
+        match.match = match_obj
+        match.img_data = match.decoded = None
+        match._offset = relative_offset
+        match._length = length
+        match._parent = parent
+        match._max_child_end = None
+        match._global_offset = parent._global_offset + relative_offset
+        match._root = parent._root
+        match.matcher = parent.matcher
+        match.extension = _guess_extension(name)
+        parent._add_child(match)
+        return match
+
+    def _add_child(self, child: "Match"):
+        self._children.append(child)
+        # invalidate the cached end offsets of all ancestors whose lengths are inferred from their children;
+        # a new child can move an ancestor's end in either direction, since relative offsets can be negative
+        match: Optional[Match] = self
+        while match is not None and match._length is None:
+            match._max_child_end = None
+            match = match._parent
 
     @property
     def children(self) -> Tuple["Match", ...]:
@@ -132,20 +215,19 @@ class Match:
     def parent(self) -> Optional["Match"]:
         return self._parent
 
+    @property
+    def filetype(self) -> str:
+        """The `filetype` of this match's match object, if it has one, or otherwise the name of this match"""
+        return getattr(self.match, "filetype", self.name)
+
     @property
     def offset(self) -> int:
         """The global offset of this match with respect to the original file"""
-        if self.parent is not None:
-            return self.parent.offset + self.relative_offset
-        else:
-            return self.relative_offset
+        return self._global_offset
 
     @property
     def root(self) -> "Match":
-        if self.parent is None:
-            return self
-        else:
-            return self.parent.root
+        return self._root
 
     @property
     def root_offset(self) -> int:
@@ -160,10 +242,11 @@ class Match:
     def length(self) -> int:
         """The number of bytes in the match"""
         if self._length is None:
-            if self._children:
-                return max(c.offset + c.length for c in self._children) - self.offset
-            else:
-                return 0
+            if self._max_child_end is None:
+                if not self._children:
+                    return 0
+                self._max_child_end = max(c._global_offset + c.length for c in self._children)
+            return self._max_child_end - self._global_offset
         return self._length
 
     def to_obj(self):
@@ -179,7 +262,7 @@ class Match:
         if self.img_data is not None:
             ret['img_data'] = self.img_data
         if self.decoded is not None:
-            ret['decoded'] = base64.b64encode(self.decoded).decode('utf-8')
+            ret['decoded'] = b2a_base64(self.decoded, newline=False).decode('ascii')
         if self.extension is not None:
             ret['extension'] = self.extension
         return ret
@@ -195,15 +278,17 @@ class Match:
 
 
 class Submatch(Match):
-    pass
+    __slots__ = ()
 
 
 def register_parser(*filetypes: str) -> Callable[[Union[Parser, ParserFunction]], Parser]:
     def wrapper(parser: Union[Parser, ParserFunction]) -> Parser:
         if not isinstance(parser, Parser):
             parser = ParserFunctionWrapper(parser)
+        _REGISTRATION_ORDER.setdefault(parser, len(_REGISTRATION_ORDER))
         for ft in filetypes:
             PARSERS[ft].add(parser)
+            _FROZEN_PARSERS[ft] = _freeze_parsers(PARSERS[ft])
         return parser
     return wrapper
 
@@ -243,40 +328,43 @@ class Matcher:
             extension=extension
         )
         yield m
-        if self.parse:
-            for parser in PARSERS[mimetype]:
-                # Don't yield this custom match until we've tried its submatch function
-                # (which may throw an InvalidMatch, meaning that this match is invalid)
+        if not self.parse:
+            return
+        parsers = frozen_parsers(mimetype)
+        if not parsers:
+            # most MIME types have no parser, so there is nothing left to do
+            return
+        # all of the parsers share a single window onto the matched region
+        with FileStream(file_stream, start=offset, length=length) as fs:
+            for parser in parsers:
+                # a parser may raise an InvalidMatch at any point, meaning that this match is invalid
                 try:
-                    with FileStream(file_stream, start=offset, length=length) as fs:
-                        submatch_iter = parser(fs, m)
-                        try:
-                            first_submatch = next(submatch_iter)
-                            has_first = True
-                        except StopIteration:
-                            has_first = False
-                        if has_first:
-                            yield first_submatch
-                            yield from submatch_iter
+                    fs.seek(0)
+                    for submatch in parser(fs, m):
+                        yield submatch
                 except InvalidMatch:
                     pass
                 except Exception as e:
                     log.warning(f"Parser {parser!s} for MIME type {mimetype} raised an exception while "
-                                f"parsing {match_obj!s} in {file_stream!s}: {e!s}")
+                                f"parsing {match_obj!s} in {getattr(file_stream, 'name', file_stream)!s}: {e!s}")
                     if log.isEnabledFor(logger.logging.DEBUG):
                         traceback.print_exc()
 
     def identify(
             self, file_stream: Union[str, Path, IO, FileStream]
     ) -> Iterator[MagicMatch]:
+        # the magic matches are returned to the caller, and they keep the context's data, so do not memory map it
         with FileStream(file_stream) as f:
             context = MatchContext.load(f, only_match_mime=False)
             yield from self.magic_matcher.match(context)
 
     def match(self, file_stream: Union[str, Path, IO, FileStream], parent: Optional[Match] = None) -> Iterator[Match]:
-        with FileStream(file_stream) as f:
+        # large files are memory mapped so that, apart from the read-ahead of their head and tail, tests only page in
+        # the regions they actually read; the map is closed once matching is done, so the magic matches and their
+        # context must not escape this method
+        with FileStream(file_stream) as f, MemoryMap(f) as data:
             matched_mimetypes: Set[str] = set()
-            context = MatchContext.load(f, only_match_mime=True)
+            context = MatchContext.load(f, only_match_mime=True, data=data)
             for magic_match in self.magic_matcher.match(context):
                 for result in magic_match:
                     if result.test.mime is None:
@@ -285,7 +373,8 @@ class Matcher:
                     if mimetype in matched_mimetypes:
                         continue
                     matched_mimetypes.add(mimetype)
-                    yield from self.handle_mimetype(mimetype, result, context.data, file_stream, parent)
+                    # pass the already open stream so that parsers do not have to reopen the file
+                    yield from self.handle_mimetype(mimetype, result, context.data, f, parent)
 
 
 class Analyzer:
@@ -347,18 +436,16 @@ class Analyzer:
                 except StopIteration:
                     self._match_iterator = None
                     break
-                if hasattr(match.match, "filetype"):
-                    filetype = match.match.filetype
-                else:
-                    filetype = match.name
                 if match.parent is None:
-                    log.info(f"Found a file of type {filetype} at byte offset {match.offset}")
+                    log.info(f"Found a file of type {match.filetype} at byte offset {match.offset}")
                     self._matches.append(match)
                     yield match
                 elif isinstance(match, Submatch):
-                    log.debug(f"Found a subregion of type {filetype} at byte offset {match.offset}")
+                    # submatches vastly outnumber the other matches, so only format their message if it will be logged
+                    if log.isEnabledFor(logger.logging.DEBUG):
+                        log.debug(f"Found a subregion of type {match.filetype} at byte offset {match.offset}")
                 else:
-                    log.info(f"Found an embedded file of type {filetype} at byte offset {match.offset}")
+                    log.info(f"Found an embedded file of type {match.filetype} at byte offset {match.offset}")
         else:
             yield from self._matches
 
@@ -379,25 +466,40 @@ class Analyzer:
         else:
             yield from self._magic_matches
 
-    def sbud(self, matches: Optional[Iterable[Match]] = None) -> Dict[str, Any]:
-        if matches is None:
-            matches = self.matches()
+    def _encode_contents(self, write: Callable[[str], Any]) -> Tuple[str, str, str, int]:
+        """
+        Base64 encodes the file a chunk at a time, passing each encoded chunk to `write`
+
+        Returns the MD5, SHA1, and SHA256 hex digests of the file, as well as its length in bytes, which are computed
+        in the same pass over the file.
+
+        """
         md5 = hashlib.md5()
         sha1 = hashlib.sha1()
         sha256 = hashlib.sha256()
-        with open(self.path, 'rb') as hash_file:
-            data = hash_file.read()
-            md5.update(data)
-            sha1.update(data)
-            sha256.update(data)
-            b64contents = base64.b64encode(data)
-            file_length = len(data)
-            del data
+        file_length = 0
+        with open(self.path, 'rb') as f:
+            while True:
+                data = f.read(SBUD_CHUNK_SIZE)
+                if not data:
+                    break
+                md5.update(data)
+                sha1.update(data)
+                sha256.update(data)
+                file_length += len(data)
+                write(b2a_base64(data, newline=False).decode('ascii'))
+        return md5.hexdigest(), sha1.hexdigest(), sha256.hexdigest(), file_length
+
+    def sbud(self, matches: Optional[Iterable[Match]] = None) -> Dict[str, Any]:
+        if matches is None:
+            matches = self.matches()
+        b64chunks: List[str] = []
+        md5, sha1, sha256, file_length = self._encode_contents(b64chunks.append)
         return {
-            'MD5': md5.hexdigest(),
-            'SHA1': sha1.hexdigest(),
-            'SHA256': sha256.hexdigest(),
-            'b64contents': b64contents.decode('utf-8'),
+            'b64contents': "".join(b64chunks),
+            'MD5': md5,
+            'SHA1': sha1,
+            'SHA256': sha256,
             'fileName': self.path,
             'length': file_length,
             'versions': {
@@ -407,3 +509,25 @@ class Analyzer:
                 match.to_obj() for match in matches
             ]
         }
+
+    def write_sbud(self, output: IO[str], matches: Optional[Iterable[Match]] = None):
+        """
+        Writes the same JSON as `json.dump(self.sbud(matches), output)`, but incrementally
+
+        The file contents are hashed and base64 encoded a chunk at a time, in a single pass, and each match is
+        serialized as soon as it is converted, so neither the encoded file nor the entire match tree has to be held in
+        memory at once.
+
+        """
+        if matches is None:
+            matches = self.matches()
+        output.write('{"b64contents": "')
+        md5, sha1, sha256, file_length = self._encode_contents(output.write)
+        output.write(f'", "MD5": {dumps(md5)}, "SHA1": {dumps(sha1)}, "SHA256": {dumps(sha256)}, '
+                     f'"fileName": {dumps(self.path)}, "length": {file_length}, '
+                     f'"versions": {dumps({"polyfile": __version__})}, "struc": [')
+        for i, match in enumerate(matches):
+            if i > 0:
+                output.write(", ")
+            dump(match.to_obj(), output)
+        output.write("]}")
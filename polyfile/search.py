@@ -1,22 +1,58 @@
+from array import array
+from codecs import latin_1_decode
 from collections import deque
 import collections.abc
-from typing import IO, Mapping, Sequence, Union
+from typing import Any, Callable, FrozenSet, IO, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 from . import serialization
 
 
+# the number of bytes to read at a time when searching a stream
+SEARCH_CHUNK_SIZE: int = 1048576
+
+# chunks of at least this many bytes are searched by the Numba-compiled `ACTable` kernel, if the optional `numba`
+# package is installed; shorter chunks are not worth the one-time cost of compiling it
+COMPILED_SCAN_THRESHOLD: int = 65536
+
+# the maximum number of accepting positions that the compiled `ACTable` kernel reports per call
+COMPILED_SCAN_BATCH_SIZE: int = 4096
+
+
+def _chunks(source_sequence: Union[Sequence, IO]) -> Iterator[Sequence]:
+    """Yields the contents of `source_sequence`, reading it `SEARCH_CHUNK_SIZE` bytes at a time if it is a stream"""
+    if hasattr(source_sequence, 'read'):
+        while True:
+            chunk = source_sequence.read(SEARCH_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield source_sequence
+
+
+# shared by every trie node that does not end a sequence, which is most of them, until a source is added
+_NO_SOURCES: FrozenSet = frozenset()
+
+
 @serialization.serializable
 class TrieNode:
+    __slots__ = ("_children", "value", "_sources")
+
     def __init__(self, value=None, sources=None, _children=None):
         if _children is None:
             self._children: Mapping[object, TrieNode] = {}
         else:
             self._children = _children
         self.value = value
-        if sources is not None:
+        if sources:
             self._sources = set(sources)
         else:
-            self._sources = set()
+            self._sources = _NO_SOURCES
 
     def __repr__(self):
         return f"{self.__class__.__name__}(value={self.value!r}, sources={self.sources!r}, _children={self._children!r})"
@@ -41,35 +77,25 @@ class TrieNode:
 
     def __contains__(self, value):
         if not isinstance(value, collections.abc.Sequence):
-            first, remainder, n = value, (), 1
-        else:
-            first, remainder, n = self._car_cdr_len(value)
-        if n == 1:
-            return first in self._children
-        else:
-            return self._find(first, remainder, n)
-
-    @staticmethod
-    def _car_cdr_len(sequence):
-        n = len(sequence)
-        if n == 0:
-            first = None
+            return value in self._children
+        elif len(value) == 1:
+            return value[0] in self._children
         else:
-            first = sequence[0]
-        return first, sequence[1:], n
+            return self.find(value)
 
-    def _find(self, first, remainder, n):
-        if n == 0:
-            return len(self._sources) > 0
-        if first not in self._children:
-            return False
-        return self[first]._find(*self._car_cdr_len(remainder))
+    def _find_node(self, sequence) -> Optional["TrieNode"]:
+        node = self
+        for element in sequence:
+            node = node._children.get(element)
+            if node is None:
+                return None
+        return node
 
     def find(self, key):
-        if isinstance(key, collections.abc.Sequence):
-            return self._find(*self._car_cdr_len(key))
-        else:
-            return self._find(key, (), 1)
+        if not isinstance(key, collections.abc.Sequence):
+            key = (key,)
+        node = self._find_node(key)
+        return node is not None and len(node._sources) > 0
 
     @property
     def children(self):
@@ -86,15 +112,15 @@ class TrieNode:
 
     def _add(self, sequence, source):
         node = self
-        while True:
-            first, sequence, n = self._car_cdr_len(sequence)
-            if n == 0:
-                break
-            if first in node:
-                node = node[first]
-            else:
-                node = node._add_child(first)
-        node._sources.add(source)
+        for element in sequence:
+            child = node._children.get(element)
+            if child is None:
+                child = node._add_child(element)
+            node = child
+        if node._sources is _NO_SOURCES:
+            node._sources = {source}
+        else:
+            node._sources.add(source)
         return node
 
     def add(self, sequence, source=None):
@@ -103,14 +129,10 @@ class TrieNode:
         return self._add(sequence, source)
 
     def find_prefix(self, prefix):
-        first, remainder, n = self._car_cdr_len(prefix)
-        if n == 0:
-            yield from iter(self._sources)
-            for child in self:
-                yield from child.find_prefix(prefix)
-        else:
-            if first in self._children:
-                yield from self[first].find_prefix(remainder)
+        node = self._find_node(prefix)
+        if node is not None:
+            for descendant in node.bfs():
+                yield from descendant._sources
 
     def bfs(self):
         queue = deque([self])
@@ -136,6 +158,8 @@ class TrieNode:
 @serialization.serializable
 class ACNode(TrieNode):
     """A data structure for implementing the Aho-Corasick multi-string matching algorithm"""
+    __slots__ = ("parent", "fall")
+
     def __init__(self, value=None, sources=None, _children=None, parent=None, _fall=None):
         super().__init__(value=value, sources=sources, _children=_children)
         self.parent = parent
@@ -160,16 +184,16 @@ class ACNode(TrieNode):
         for n in self.bfs():
             if n is self:
                 continue
+            value = n.value
             new_fall = n.parent.fall
-            while n.value not in new_fall and new_fall is not self:
+            while value not in new_fall._children and new_fall is not self:
                 new_fall = new_fall.fall
-            if n.value not in new_fall:
+            fall = new_fall._children.get(value)
+            if fall is None or fall is n:
                 # there is no suffix
                 n.fall = self
             else:
-                n.fall = new_fall[n.value]
-                if n.fall is n:
-                    n.fall = self
+                n.fall = fall
 
     def to_dot(self, include_falls=False):
         """Returns a Graphviz/Dot representation of this Trie"""
@@ -205,15 +229,181 @@ class ACNode(TrieNode):
         return dot
 
 
+def _scan(goto, accepting, data, start, state, ends, states):
+    """
+    Runs an `ACTable` over `data[start:]` from `state`, stopping early once `ends` is full
+
+    Returns the number of accepting positions written to `ends` and `states`, the index of the next byte to scan, and
+    the state the automaton is in. This is compiled by `_compiled_scan`.
+
+    """
+    count = 0
+    limit = len(ends)
+    i = start
+    n = len(data)
+    while i < n:
+        state = goto[(state << 8) | data[i]]
+        if accepting[state]:
+            ends[count] = i
+            states[count] = state
+            count += 1
+            if count == limit:
+                return count, i + 1, state
+        i += 1
+    return count, i, state
+
+
+_COMPILED_SCAN: Optional[Callable] = None
+_COMPILED_SCAN_LOADED: bool = False
+
+
+def _compiled_scan() -> Optional[Callable]:
+    """
+    Returns `_scan` compiled by Numba, or None if the optional `numba` package cannot be imported
+
+    Numba is only imported the first time this is called, since importing it noticeably slows down startup.
+
+    """
+    global _COMPILED_SCAN, _COMPILED_SCAN_LOADED
+    if not _COMPILED_SCAN_LOADED:
+        _COMPILED_SCAN_LOADED = True
+        try:
+            import numba
+        except ImportError:
+            # numba is either not installed or is broken, e.g., built against a different version of numpy
+            return None
+        _COMPILED_SCAN = numba.njit(cache=True, boundscheck=False, nogil=True)(_scan)
+    return _COMPILED_SCAN
+
+
+class ACTable:
+    """
+    A finalized `ACNode` trie over bytes, flattened into a deterministic transition table
+
+    State `s` transitions on byte `b` to `goto[(s << 8) | b]`, with the fall pointers already folded into the table, so
+    a search does a single array lookup per byte. `outputs[s]` holds every sequence that ends in state `s`.
+
+    """
+    def __init__(self, root: TrieNode):
+        # number the nodes in breadth-first order, along with the number of each node's parent
+        nodes: List[Tuple[TrieNode, int]] = [(root, 0)]
+        for node_id, (node, _) in enumerate(nodes):
+            nodes.extend((child, node_id) for child in node._children.values())
+        self.goto: array = array('i', bytes(4 * 256 * len(nodes)))
+        self.outputs: List[Tuple[bytes, ...]] = [()] * len(nodes)
+        goto = self.goto
+        outputs = self.outputs
+        falls: List[int] = [0] * len(nodes)
+        child_id = 1
+        # the fall pointers are computed on the table itself rather than with `ACNode.finalize`: in breadth-first
+        # order a node's fall is always shallower, so its row and outputs are already complete
+        for node_id, (node, parent_id) in enumerate(nodes):
+            row = node_id << 8
+            if node_id > 0:
+                if parent_id > 0:
+                    fall_id = goto[(falls[parent_id] << 8) | node.value]
+                else:
+                    # the children of the root fall back to the root
+                    fall_id = 0
+                falls[node_id] = fall_id
+                fall_row = fall_id << 8
+                goto[row:row + 256] = goto[fall_row:fall_row + 256]
+                outputs[node_id] = tuple(node._sources) + outputs[fall_id]
+            for value in node._children:
+                goto[row | value] = child_id
+                child_id += 1
+        # the goto and accepting tables as numpy arrays, built the first time the compiled scan is used
+        self._compiled_tables: Optional[Tuple[Any, Any]] = None
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def search(self, source_sequence: Union[bytes, IO]) -> Iterator[Tuple[int, bytes]]:
+        goto = self.goto
+        outputs = self.outputs
+        state = 0
+        chunk_offset = 0
+        for chunk in _chunks(source_sequence):
+            if len(chunk) >= COMPILED_SCAN_THRESHOLD and isinstance(chunk, (bytes, bytearray, memoryview)) \
+                    and _compiled_scan() is not None:
+                state = yield from self._search_compiled(chunk, chunk_offset, state)
+            else:
+                for stream_offset, c in enumerate(chunk, chunk_offset):
+                    state = goto[(state << 8) | c]
+                    if outputs[state]:
+                        for source in outputs[state]:
+                            yield stream_offset - len(source) + 1, source
+            chunk_offset += len(chunk)
+
+    def _search_compiled(self, chunk: bytes, chunk_offset: int, state: int) -> Iterator[Tuple[int, bytes]]:
+        """Searches `chunk` using the Numba kernel, returning the final state of the automaton"""
+        import numpy
+
+        scan = _compiled_scan()
+        if self._compiled_tables is None:
+            self._compiled_tables = (
+                numpy.frombuffer(self.goto, dtype=numpy.intc),
+                numpy.array([bool(sources) for sources in self.outputs], dtype=numpy.bool_)
+            )
+        goto, accepting = self._compiled_tables
+        outputs = self.outputs
+        data = numpy.frombuffer(chunk, dtype=numpy.uint8)
+        ends = numpy.empty(COMPILED_SCAN_BATCH_SIZE, dtype=numpy.int64)
+        states = numpy.empty(COMPILED_SCAN_BATCH_SIZE, dtype=numpy.int64)
+        i = 0
+        while i < len(data):
+            count, i, state = scan(goto, accepting, data, i, state, ends, states)
+            for end, end_state in zip(ends[:count].tolist(), states[:count].tolist()):
+                for source in outputs[end_state]:
+                    yield chunk_offset + end - len(source) + 1, source
+        return int(state)
+
+
 class MultiSequenceSearch:
-    """A datastructure for efficiently searching a sequence for multiple strings"""
+    """
+    A datastructure for efficiently searching a sequence for multiple strings
+
+    If all of the sequences to find are bytes, bytes-like inputs and streams are searched using the C implementation
+    from the optional `pyahocorasick` package if it is installed, or otherwise using a flattened `ACTable` (whose
+    scan is compiled if the optional `numba` package is installed). Any other sequences are searched by walking the
+    `ACNode` trie.
+
+    """
     def __init__(self, *sequences_to_find):
         self.trie = ACNode()
         for seq in sequences_to_find:
             self.trie.add(seq)
-        self.trie.finalize()
+        self._automaton = None
+        self._table: Optional[ACTable] = None
+        self._all_bytes: bool = all(isinstance(seq, bytes) for seq in sequences_to_find)
+        if ahocorasick is not None and sequences_to_find and self._all_bytes:
+            # pyahocorasick operates on str, so map each byte to the code point of the same value
+            self._automaton = ahocorasick.Automaton()
+            for seq in sequences_to_find:
+                if seq:
+                    self._automaton.add_word(latin_1_decode(seq)[0], seq)
+            self._automaton.make_automaton()
+
+    @property
+    def table(self) -> Optional[ACTable]:
+        """
+        The flattened transition table for the sequences, or None if they are not all bytes
+
+        The table is only built the first time it is needed, since searches use the `pyahocorasick` automaton instead
+        whenever it is available.
+
+        """
+        if self._table is None and self._all_bytes:
+            self._table = ACTable(self.trie)
+        return self._table
+
+    def _finalize_trie(self):
+        """Computes the trie's fall pointers, which only walking the trie needs, if they have not been already"""
+        if self.trie.fall is None:
+            self.trie.finalize()
 
     def save(self, output_stream: IO):
+        self._finalize_trie()
         serialization.dump(self.trie, output_stream)
 
     @staticmethod
@@ -224,37 +414,46 @@ class MultiSequenceSearch:
         exit(0)
         return mss
 
-    def search(self, source_sequence: Union[Sequence, IO]):
+    def search(self, source_sequence: Union[Sequence, IO]) -> Iterator[Tuple[int, Sequence]]:
         """The Aho-Corasick Algorithm"""
-        if hasattr(source_sequence, 'read'):
-            def iterator():
-                while True:
-                    b = source_sequence.read(1)
-                    if not b:
-                        return
-                    yield b[0]
-        else:
-            def iterator():
-                return iter(source_sequence)
-
-        state = self.trie
-        for stream_offset, c in enumerate(iterator()):
-            n = state
-
-            while c not in n and n is not self.trie:
-                n = n.fall
-
-            if n is self.trie:
-                if c in n:
-                    n = n[c]
-            else:
-                n = n[c]
-
-            state = n
-
-            while n is not self.trie:
-                yield from ((stream_offset - len(source) + 1, source) for source in n.sources)
-                n = n.fall
+        if self._automaton is not None:
+            if hasattr(source_sequence, 'read'):
+                source_sequence = source_sequence.read()
+            if isinstance(source_sequence, (bytes, bytearray, memoryview)):
+                for end_index, source in self._automaton.iter(latin_1_decode(source_sequence)[0]):
+                    yield end_index - len(source) + 1, source
+                return
+        if self._all_bytes and (
+                hasattr(source_sequence, 'read') or isinstance(source_sequence, (bytes, bytearray, memoryview))
+        ):
+            yield from self.table.search(source_sequence)
+            return
+        yield from self._search_trie(source_sequence)
+
+    def _search_trie(self, source_sequence: Union[Sequence, IO]) -> Iterator[Tuple[int, Sequence]]:
+        self._finalize_trie()
+        root = self.trie
+        state = root
+        chunk_offset = 0
+        for chunk in _chunks(source_sequence):
+            for stream_offset, c in enumerate(chunk, chunk_offset):
+                n = state
+                child = n._children.get(c)
+
+                while child is None and n is not root:
+                    n = n.fall
+                    child = n._children.get(c)
+
+                if child is not None:
+                    n = child
+
+                state = n
+
+                while n is not root:
+                    for source in n._sources:
+                        yield stream_offset - len(source) + 1, source
+                    n = n.fall
+            chunk_offset += len(chunk)
 
 
 class StartsWithMatcher:
@@ -265,6 +464,8 @@ class StartsWithMatcher:
 
     def search(self, source_sequence: Union[Sequence, IO]):
         if hasattr(source_sequence, 'read'):
+            # a prefix can be ruled out by its first byte, so read streams one byte at a time rather than in
+            # `SEARCH_CHUNK_SIZE` chunks, leaving them positioned just past the last byte that was examined
             def iterator():
                 while True:
                     b = source_sequence.read(1)
@@ -276,14 +477,14 @@ class StartsWithMatcher:
                 return iter(source_sequence)
 
         state = self.trie
-        yield from ((0, s) for s in state.sources)
+        yield from ((0, s) for s in state._sources)
 
         for c in iterator():
-            if c not in state:
+            state = state._children.get(c)
+            if state is None:
                 return
 
-            state = state[c]
-            yield from ((0, s) for s in state.sources)
+            yield from ((0, s) for s in state._sources)
 
 
 if __name__ == '__main__':
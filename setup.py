@@ -41,6 +41,8 @@ setup(
     ],
     extras_require={
         'demangle': ['cxxfilt'],
+        'ahocorasick': ['pyahocorasick'],
+        'numba': ['numba'],
         "dev": ["mypy", "pytest", "flake8"]
     },
     entry_points={
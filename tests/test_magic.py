@@ -1,10 +1,19 @@
+from contextlib import redirect_stdout
+from io import StringIO
+import mmap
 from pathlib import Path
+import pickle
 from typing import Callable, Optional
 from unittest import TestCase
 
 # from polyfile import logger
+from polyfile import fileutils
+from polyfile.debugger import Debugger
 import polyfile.magic
 from polyfile.magic import MagicMatcher, MAGIC_DEFS
+import polyfile.pdf
+import polyfile.pickles
+from polyfile.polyfile import Matcher
 
 
 # logger.setLevel(logger.TRACE)
@@ -120,6 +129,101 @@ class MagicTest(TestCase):
         self.assertIs(matcher, matcher.only_match())
         self.assertIn("application/zip", matcher.only_match(mimetypes=("application/zip",)).mimetypes)
         self.assertIn("com", matcher.only_match(extensions=("com",)).extensions)
+        # derived matchers are cached until a new test is added:
+        zip_matcher = matcher.only_match(mimetypes=["application/zip"])
+        self.assertIs(zip_matcher, matcher.only_match(mimetypes=("application/zip",)))
+        matcher.add(polyfile.magic.OctetStreamTest())
+        self.assertIsNot(zip_matcher, matcher.only_match(mimetypes=("application/zip",)))
+
+    def test_anchored_tests(self):
+        matcher = MagicMatcher.parse(*MAGIC_DEFS)
+        data = b"\x89PNG\x0d\x0a\x1a\x0a\x00\x00\x00\x0dIHDR"
+        candidates = matcher.anchored_candidates(data)
+        self.assertTrue(candidates)
+        self.assertLessEqual(candidates, matcher.anchored_tests)
+        for test in candidates:
+            offset, literal = test.literal_prefix()
+            self.assertEqual(data[offset:offset + len(literal)], literal)
+        self.assertIn("image/png", {mime for test in candidates for mime in test.mimetypes()})
+
+    def test_literal_string_match(self):
+        literal = polyfile.magic.StringMatch("GIF8")
+        self.assertTrue(literal.is_literal)
+        self.assertEqual(literal.matches(b"GIF89a").raw_match, b"GIF8")
+        self.assertFalse(literal.matches(b"gif89a"))
+        self.assertFalse(literal.matches(b"GIF"))
+        insensitive = polyfile.magic.StringMatch("GIF8", case_insensitive_upper=True)
+        self.assertFalse(insensitive.is_literal)
+        self.assertEqual(insensitive.matches(b"gif89a").raw_match, b"gif8")
+
+    def test_indirect_results(self):
+        for d in MAGIC_DEFS:
+            if d.name == "elf":
+                elf_def = d
+                break
+        else:
+            self.fail("Could not find the elf test!")
+        matcher = MagicMatcher.parse(elf_def)
+        context = polyfile.magic.MatchContext(b"xxxx\x7fELF\x02\x01\x01")
+        results = context.indirect_results(matcher, 4)
+        self.assertIs(results, context.indirect_results(matcher, 4))
+        self.assertEqual(
+            [str(r) for r in results],
+            [str(r) for m in matcher.match(b"\x7fELF\x02\x01\x01") for r in m]
+        )
+        self.assertTrue(results)
+
+    def test_memory_mapped_matching(self):
+        matcher = MagicMatcher.DEFAULT_INSTANCE
+        inputs = {
+            "application/x-python-pickle": pickle.dumps({"polyfile": list(range(100))}, protocol=3),
+            "application/pdf": b"junk\n%PDF-1.4\n%%EOF\n"
+        }
+        old_threshold = fileutils.MMAP_THRESHOLD
+        try:
+            for mimetype, contents in inputs.items():
+                with self.subTest(mimetype=mimetype), fileutils.Tempfile(contents) as path, open(path, "rb") as f:
+                    fileutils.MMAP_THRESHOLD = 0
+                    with fileutils.MemoryMap(f) as data:
+                        self.assertIsInstance(data, mmap.mmap)
+                        mapped = polyfile.magic.MatchContext.load(f, data=data)
+                        mapped_mimetypes = {m for match in matcher.match(mapped) for m in match.mimetypes}
+                    # the memory map is closed as soon as its owner is done with it
+                    self.assertTrue(data.closed)
+                    fileutils.MMAP_THRESHOLD = len(contents) + 1
+                    with fileutils.MemoryMap(f) as data:
+                        self.assertIsNone(data)
+                    read = polyfile.magic.MatchContext.load(path)
+                    self.assertIsInstance(read.data, bytes)
+                    read_mimetypes = {m for match in matcher.match(read) for m in match.mimetypes}
+                    self.assertEqual(mapped_mimetypes, read_mimetypes)
+                    self.assertIn(mimetype, mapped_mimetypes)
+        finally:
+            fileutils.MMAP_THRESHOLD = old_threshold
+
+    def test_memory_mapped_debugging(self):
+        contents = b"junk\n%PDF-1.4\n%%EOF\n"
+        old_threshold = fileutils.MMAP_THRESHOLD
+        fileutils.MMAP_THRESHOLD = 0
+        try:
+            with fileutils.Tempfile(contents) as path, open(path, "rb") as f:
+                with fileutils.MemoryMap(f) as data:
+                    self.assertIsInstance(data, mmap.mmap)
+                    mapped = StringIO()
+                    with redirect_stdout(mapped):
+                        Debugger().print_context(data, 5, context_bytes=5, num_bytes=4)
+                read = StringIO()
+                with redirect_stdout(read):
+                    Debugger().print_context(contents, 5, context_bytes=5, num_bytes=4)
+                # the magic matches outlive `identify`, so their data must still be readable
+                magic_matches = list(Matcher().identify(path))
+        finally:
+            fileutils.MMAP_THRESHOLD = old_threshold
+        self.assertEqual(mapped.getvalue(), read.getvalue())
+        self.assertIn("%PDF", mapped.getvalue())
+        self.assertTrue(magic_matches)
+        for match in magic_matches:
+            self.assertEqual(match.data[:4], b"junk")
 
     def test_can_match_mime(self):
         for d in MAGIC_DEFS:
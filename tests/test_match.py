@@ -0,0 +1,130 @@
+from unittest import TestCase
+
+from polyfile import polyfile
+from polyfile.fileutils import FileStream
+from polyfile.polyfile import Match, Matcher, Submatch
+
+
+class TestMatch(TestCase):
+    def test_offsets(self):
+        root = Match("root", None, relative_offset=10, matcher=Matcher())
+        child = Submatch("child", None, relative_offset=5, parent=root)
+        grandchild = Submatch("grandchild", None, relative_offset=3, length=4, parent=child)
+        self.assertEqual(root.offset, 10)
+        self.assertEqual(child.offset, 15)
+        self.assertEqual(grandchild.offset, 18)
+        self.assertIs(grandchild.root, root)
+        self.assertEqual(grandchild.root_offset, 8)
+
+    def test_inferred_length(self):
+        root = Match("root", None, matcher=Matcher())
+        self.assertEqual(root.length, 0)
+        child = Submatch("child", None, relative_offset=2, parent=root)
+        self.assertEqual(child.length, 0)
+        self.assertEqual(root.length, 2)
+        Submatch("grandchild", None, relative_offset=1, length=5, parent=child)
+        # adding a descendant grows the inferred lengths of all of its ancestors
+        self.assertEqual(child.length, 6)
+        self.assertEqual(root.length, 8)
+        Submatch("sibling", None, relative_offset=0, length=3, parent=root)
+        self.assertEqual(root.length, 8)
+        fixed = Submatch("fixed", None, relative_offset=20, length=1, parent=root)
+        Submatch("overflow", None, relative_offset=0, length=10, parent=fixed)
+        # explicit lengths are never overridden by children
+        self.assertEqual(fixed.length, 1)
+        self.assertEqual(root.length, 21)
+
+    def test_inferred_length_negative_offset(self):
+        root = Match("root", None, matcher=Matcher())
+        child = Submatch("child", None, relative_offset=10, parent=root)
+        self.assertEqual(root.length, 10)
+        Submatch("grandchild", None, relative_offset=-5, length=2, parent=child)
+        # a descendant before its parent's offset shrinks the inferred lengths of its ancestors
+        self.assertEqual(child.length, -3)
+        self.assertEqual(root.length, 7)
+
+    def test_fast(self):
+        root = Match("root", None, relative_offset=10, matcher=Matcher())
+        expected = Submatch("child", None, relative_offset=5, length=3, parent=root)
+        fast = Submatch._fast("child", None, 5, 3, root)
+        self.assertIsInstance(fast, Submatch)
+        self.assertEqual(root.children, (expected, fast))
+        for attr in Match.__slots__:
+            self.assertEqual(getattr(fast, attr), getattr(expected, attr), attr)
+
+
+class TestParserRegistry(TestCase):
+    mimetype = "application/x-polyfile-test"
+
+    def tearDown(self):
+        for parser in polyfile.PARSERS.pop(self.mimetype, ()):
+            polyfile._REGISTRATION_ORDER.pop(parser, None)
+        polyfile._FROZEN_PARSERS.pop(self.mimetype, None)
+
+    def test_frozen_parsers(self):
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), ())
+        first = polyfile.register_parser(self.mimetype)(lambda stream, match: iter(()))
+        second = polyfile.register_parser(self.mimetype)(lambda stream, match: iter(()))
+        polyfile.register_parser(self.mimetype)(first)
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), (first, second))
+        self.assertEqual(polyfile.PARSERS[self.mimetype], {first, second})
+
+    def test_frozen_parsers_direct_modification(self):
+        first = polyfile.register_parser(self.mimetype)(lambda stream, match: iter(()))
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), (first,))
+        second = polyfile.ParserFunctionWrapper(lambda stream, match: iter(()))
+        polyfile.PARSERS[self.mimetype].add(second)
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), (first, second))
+        polyfile.PARSERS[self.mimetype] = {second}
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), (second,))
+        polyfile.PARSERS[self.mimetype].discard(second)
+        polyfile.PARSERS[self.mimetype].add(first)
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), (first,))
+        polyfile.PARSERS[self.mimetype].clear()
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), ())
+
+    def test_frozen_parsers_direct_order(self):
+        def b(stream, match):
+            return iter(())
+
+        def a(stream, match):
+            return iter(())
+
+        first = polyfile.register_parser(self.mimetype)(lambda stream, match: iter(()))
+        unregistered_b = polyfile.ParserFunctionWrapper(b)
+        unregistered_a = polyfile.ParserFunctionWrapper(a)
+        polyfile.PARSERS[self.mimetype] |= {unregistered_b, unregistered_a}
+        # parsers added directly come after the registered ones, ordered by name rather than by their hashes
+        self.assertEqual(polyfile.frozen_parsers(self.mimetype), (first, unregistered_a, unregistered_b))
+
+    def test_parsers_share_window(self):
+        class Result:
+            class test:
+                @staticmethod
+                def all_extensions():
+                    return iter(())
+
+        reads = []
+
+        def exhausting(stream, match):
+            reads.append(stream.read())
+            return iter(())
+
+        def partial(stream, match):
+            reads.append(stream.read(3))
+            return iter(())
+
+        def make_reader():
+            def reader(stream, match):
+                reads.append((stream.tell(), stream.read()))
+                return iter(())
+            return reader
+
+        data = b"junkMATCHED DATA"
+        for parser in (exhausting, make_reader(), partial, make_reader()):
+            polyfile.register_parser(self.mimetype)(parser)
+        with FileStream(data) as f:
+            matches = list(Matcher().handle_mimetype(self.mimetype, Result(), data, f, offset=4))
+        self.assertEqual(len(matches), 1)
+        # every parser starts reading at offset 0 of the match, wherever the previous parser left the stream
+        self.assertEqual(reads, [b"MATCHED DATA", (0, b"MATCHED DATA"), b"MAT", (0, b"MATCHED DATA")])
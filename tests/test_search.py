@@ -0,0 +1,129 @@
+from importlib.util import find_spec
+from io import BytesIO
+import random
+from typing import Iterable, Set, Tuple
+from unittest import TestCase, skipIf
+
+from polyfile import search
+from polyfile.search import MultiSequenceSearch, StartsWithMatcher, TrieNode
+
+
+def naive_search(data: bytes, *sequences: bytes) -> Set[Tuple[int, bytes]]:
+    results = set()
+    for seq in sequences:
+        offset = data.find(seq)
+        while offset >= 0:
+            results.add((offset, seq))
+            offset = data.find(seq, offset + 1)
+    return results
+
+
+class TestSearch(TestCase):
+    SEQUENCES: Tuple[bytes, ...] = (b'hack', b'hacker', b'crack', b'ack', b'kool')
+    TO_SEARCH: bytes = b'This is a test to see if hack or hacker is in this string.' \
+                       b'Can you crack it? If so, please ack, \'cause that would be kool.'
+
+    def assert_matches_naive(self, data: bytes, sequences: Iterable[bytes]):
+        sequences = tuple(sequences)
+        mss = MultiSequenceSearch(*sequences)
+        expected = naive_search(data, *sequences)
+        self.assertEqual(set(mss.search(data)), expected)
+        self.assertEqual(set(mss.search(BytesIO(data))), expected)
+
+    def test_trie(self):
+        root = TrieNode()
+        root.add('The quick brown fox jumps over the lazy dog')
+        root.add('The quick person')
+        root.add('The best')
+        self.assertEqual(len(list(root.find_prefix('The'))), 3)
+        self.assertEqual(len(list(root.find_prefix('The quick'))), 2)
+        self.assertFalse(root.find('The'))
+        self.assertTrue(root.find('The best'))
+        self.assertIn('The best', root)
+        self.assertNotIn('The', root)
+
+    def test_multi_sequence_search(self):
+        self.assert_matches_naive(self.TO_SEARCH, self.SEQUENCES)
+
+    def test_pure_python_search(self):
+        old_ahocorasick = search.ahocorasick
+        search.ahocorasick = None
+        try:
+            self.assert_matches_naive(self.TO_SEARCH, self.SEQUENCES)
+        finally:
+            search.ahocorasick = old_ahocorasick
+
+    def test_trie_search(self):
+        mss = MultiSequenceSearch(*self.SEQUENCES)
+        self.assertEqual(set(mss._search_trie(self.TO_SEARCH)), naive_search(self.TO_SEARCH, *self.SEQUENCES))
+
+    def test_table_is_lazy(self):
+        mss = MultiSequenceSearch(*self.SEQUENCES)
+        list(mss.search(self.TO_SEARCH))
+        if search.ahocorasick is not None:
+            self.assertIsNone(mss._table)
+        self.assertIsNotNone(mss.table)
+        self.assertIsNone(MultiSequenceSearch("not", "bytes").table)
+
+    def test_table_search(self):
+        rand = random.Random(31337)
+        for _ in range(20):
+            data = bytes(rand.randint(0, 3) for _ in range(rand.randint(0, 500)))
+            sequences = {bytes(rand.randint(0, 3) for _ in range(rand.randint(1, 6))) for _ in range(10)}
+            mss = MultiSequenceSearch(*sequences)
+            expected = list(mss._search_trie(data))
+            self.assertEqual(list(mss.table.search(data)), expected)
+            self.assertEqual(set(expected), naive_search(data, *sequences))
+
+    def test_table_skips_finalize(self):
+        mss = MultiSequenceSearch(*self.SEQUENCES)
+        self.assertEqual(set(mss.table.search(self.TO_SEARCH)), naive_search(self.TO_SEARCH, *self.SEQUENCES))
+        # the table computes its own fall pointers, so the trie's are never needed
+        self.assertIsNone(mss.trie.fall)
+
+    @skipIf(find_spec("numba") is None, "the optional numba package is not installed")
+    def test_compiled_table_search(self):
+        old_threshold, old_batch_size = search.COMPILED_SCAN_THRESHOLD, search.COMPILED_SCAN_BATCH_SIZE
+        search.COMPILED_SCAN_THRESHOLD = 0
+        search.COMPILED_SCAN_BATCH_SIZE = 3
+        try:
+            rand = random.Random(1337)
+            for _ in range(20):
+                data = bytes(rand.randint(0, 3) for _ in range(rand.randint(0, 500)))
+                sequences = {bytes(rand.randint(0, 3) for _ in range(rand.randint(1, 6))) for _ in range(10)}
+                mss = MultiSequenceSearch(*sequences)
+                self.assertEqual(list(mss.table.search(data)), list(mss._search_trie(data)))
+                self.assertEqual(list(mss.table.search(BytesIO(data))), list(mss._search_trie(data)))
+        finally:
+            search.COMPILED_SCAN_THRESHOLD, search.COMPILED_SCAN_BATCH_SIZE = old_threshold, old_batch_size
+
+    def test_chunked_stream_search(self):
+        old_ahocorasick, old_chunk_size = search.ahocorasick, search.SEARCH_CHUNK_SIZE
+        search.ahocorasick = None
+        search.SEARCH_CHUNK_SIZE = 7
+        try:
+            self.assert_matches_naive(self.TO_SEARCH, self.SEQUENCES)
+        finally:
+            search.ahocorasick, search.SEARCH_CHUNK_SIZE = old_ahocorasick, old_chunk_size
+
+    def test_random_search(self):
+        rand = random.Random(1337)
+        for _ in range(20):
+            data = bytes(rand.randint(0, 3) for _ in range(rand.randint(0, 500)))
+            sequences = {bytes(rand.randint(0, 3) for _ in range(rand.randint(1, 6))) for _ in range(10)}
+            self.assert_matches_naive(data, sequences)
+
+    def test_starts_with(self):
+        swm = StartsWithMatcher(*self.SEQUENCES)
+        self.assertEqual(set(swm.search(b'hacker')), {(0, b'hack'), (0, b'hacker')})
+        self.assertEqual(set(swm.search(b'xhacker')), set())
+
+    def test_starts_with_stream(self):
+        swm = StartsWithMatcher(*self.SEQUENCES)
+        stream = BytesIO(b'hacker' + bytes(100))
+        self.assertEqual(set(swm.search(stream)), {(0, b'hack'), (0, b'hacker')})
+        # the stream is only read up to the first byte that cannot extend a prefix
+        self.assertEqual(stream.tell(), 7)
+        stream = BytesIO(b'xhacker')
+        self.assertEqual(set(swm.search(stream)), set())
+        self.assertEqual(stream.tell(), 1)
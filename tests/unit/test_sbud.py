@@ -0,0 +1,25 @@
+from io import StringIO
+import json
+from unittest import TestCase
+
+from polyfile import polyfile
+from polyfile.fileutils import Tempfile
+
+
+class TestSBUD(TestCase):
+    def test_write_sbud(self):
+        contents = b"%PDF-1.4\n" + bytes(range(256)) * 7
+        old_chunk_size = polyfile.SBUD_CHUNK_SIZE
+        polyfile.SBUD_CHUNK_SIZE = 30
+        try:
+            with Tempfile(contents) as path:
+                analyzer = polyfile.Analyzer(path)
+                matches = list(analyzer.matches())
+                expected = StringIO()
+                json.dump(analyzer.sbud(matches=matches), expected)
+                actual = StringIO()
+                analyzer.write_sbud(actual, matches=matches)
+        finally:
+            polyfile.SBUD_CHUNK_SIZE = old_chunk_size
+        self.assertEqual(expected.getvalue(), actual.getvalue())
+        self.assertEqual(len(contents), json.loads(actual.getvalue())["length"])